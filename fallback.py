@@ -0,0 +1,176 @@
+"""Pure Python scorers, used only when rapidfuzz is not installed.
+
+They mirror the rapidfuzz functions used by the app, on strings that are
+already preprocessed, but are orders of magnitude slower. If numba is
+installed the edit distance kernel is JIT compiled, which closes most of
+that gap.
+"""
+import functools
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def default_process(s):
+    """Lowercase ``s``, turn non alphanumeric characters into spaces and trim it."""
+    return "".join(c if c.isalnum() else " " for c in s).lower().strip()
+
+
+def _indel_distance_py(a, b, max_dist):
+    """Minimum number of insertions and deletions turning ``a`` into ``b``.
+
+    Wagner-Fisher with a single rolling row over the shorter string, so it
+    needs O(min(len(a), len(b))) memory. A substitution costs two edits, which
+    is what ratio is defined on. Gives up with ``max_dist + 1`` as soon as a
+    whole row exceeds ``max_dist``, since the distance can only grow from there.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            if ca == cb:
+                cur[j] = prev[j - 1]
+            else:
+                cur[j] = min(prev[j], cur[j - 1]) + 1
+        if min(cur) > max_dist:
+            return max_dist + 1
+        prev = cur
+    return prev[-1]
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _indel_distance_nb(a, b, max_dist):
+        # Same rolling row DP as _indel_distance_py, on arrays of code points
+        if a.shape[0] < b.shape[0]:
+            a, b = b, a
+        n = b.shape[0]
+        prev = np.arange(n + 1)
+        cur = np.empty(n + 1, dtype=prev.dtype)
+        for i in range(a.shape[0]):
+            cur[0] = i + 1
+            row_min = cur[0]
+            ca = a[i]
+            for j in range(n):
+                if ca == b[j]:
+                    cur[j + 1] = prev[j]
+                else:
+                    cur[j + 1] = min(prev[j + 1], cur[j]) + 1
+                row_min = min(row_min, cur[j + 1])
+            if row_min > max_dist:
+                return max_dist + 1
+            prev, cur = cur, prev
+        return prev[n]
+
+    @functools.lru_cache(maxsize=1 << 16)
+    def _code_points(s):
+        # UTF-32 keeps one array element per character, unlike UTF-8 bytes
+        return np.frombuffer(s.encode("utf-32-le"), dtype=np.uint32)
+
+    def _indel_distance(a, b, max_dist):
+        return int(_indel_distance_nb(_code_points(a), _code_points(b), max_dist))
+
+    # Compile (or load from the on disk cache) now rather than on the first match
+    _indel_distance("a", "b", 2)
+else:
+    _indel_distance = _indel_distance_py
+
+
+def indel_distance(a, b, max_dist=None):
+    """Indel distance of ``a`` and ``b``, or ``max_dist + 1`` if it exceeds ``max_dist``."""
+    if max_dist is None:
+        max_dist = len(a) + len(b)
+    return _indel_distance(a, b, max_dist)
+
+
+def ratio(a, b, score_cutoff=0):
+    """Normalized Indel similarity in 0-100, or 0 if below ``score_cutoff``."""
+    total = len(a) + len(b)
+    if total == 0:
+        return 100.0
+    # Each character of length difference costs an edit, whatever the strings.
+    # The slack keeps float rounding from rejecting a score equal to the cutoff.
+    if 200 * min(len(a), len(b)) < (score_cutoff - 1e-9) * total:
+        return 0.0
+    max_dist = int(total * (100 - score_cutoff) / 100 + 1e-9)
+    score = 100.0 * (1 - indel_distance(a, b, max_dist) / total)
+    return score if score >= score_cutoff else 0.0
+
+
+def _best_window_ratio(shorter, longer, score_cutoff):
+    size = len(shorter)
+    windows = [longer[start:start + size] for start in range(len(longer) - size + 1)]
+    # Windows cut off by either end of the longer string, like rapidfuzz
+    windows += [longer[:end] for end in range(1, size)]
+    windows += [longer[-end:] for end in range(1, size)]
+    best = 0.0
+    for window in windows:
+        # Each window only has to beat the best one so far
+        best = max(best, ratio(shorter, window, max(best, score_cutoff)))
+        if best == 100:
+            break
+    return best
+
+
+def partial_ratio(a, b, score_cutoff=0):
+    """Best ratio of the shorter string against any window of the longer one."""
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return 100.0 if not b else 0.0
+    best = _best_window_ratio(a, b, score_cutoff)
+    if len(a) == len(b) and best < 100:
+        best = max(best, _best_window_ratio(b, a, max(best, score_cutoff)))
+    return best if best >= score_cutoff else 0.0
+
+
+def token_set_ratio(a, b, score_cutoff=0):
+    """Token set ratio of two strings of sorted, space separated tokens."""
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    if not tokens_a or not tokens_b:
+        return 0.0
+    intersection = " ".join(sorted(tokens_a & tokens_b))
+    diff_ab = " ".join(sorted(tokens_a - tokens_b))
+    diff_ba = " ".join(sorted(tokens_b - tokens_a))
+    if intersection and (not diff_ab or not diff_ba):
+        return 100.0
+    combined_ab = f"{intersection} {diff_ab}".strip()
+    combined_ba = f"{intersection} {diff_ba}".strip()
+    best = ratio(combined_ab, combined_ba, score_cutoff)
+    if intersection:
+        best = max(best, ratio(intersection, combined_ab, max(best, score_cutoff)))
+        best = max(best, ratio(intersection, combined_ba, max(best, score_cutoff)))
+    return best
+
+
+def extract_one(query, choices, scorer, score_cutoff=0, order=None):
+    """Like ``rapidfuzz.process.extractOne``: ``(choice, score, index)`` or None.
+
+    Choices are ranked on their score rounded half up, with ties going to the
+    lowest index, so the pick is the one argmax makes over cdist's integer
+    scores. Only the choices at the indices in ``order`` are scored, in that
+    order, or all of them by default. Listing the choices closest in length to
+    ``query`` first makes the best score rise early, so the scorer can cut the
+    remaining ones short.
+    """
+    best = None
+    best_rounded = 0
+    if order is None:
+        order = range(len(choices))
+    for index in order:
+        # Anything rounding to the best score so far can still win a tie
+        cutoff = score_cutoff if best is None else max(score_cutoff, best_rounded - 0.5)
+        score = scorer(query, choices[index], cutoff)
+        if score < cutoff:
+            continue
+        rounded = int(score + 0.5)
+        if best is None or rounded > best_rounded or (rounded == best_rounded and index < best[2]):
+            best = (choices[index], score, index)
+            best_rounded = rounded
+    return best
@@ -1,19 +1,120 @@
 import streamlit as st
 import pandas as pd
-from fuzzywuzzy import fuzz
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import hashlib
 import io
 
+from matching import (
+    HAS_RAPIDFUZZ,
+    MATRIX_METHODS,
+    clear_preprocess_cache,
+    iter_best_matches,
+    iter_matrix_best_matches,
+    preprocess,
+)
+
+# Earlier match runs kept in session state, so identical reruns are instant.
+# Not st.cache_data, which would record the progress bar updates and replay
+# them on every hit.
+MATCH_CACHE_SIZE = 8
+
+# Rows rendered through the (slow) color coding Styler
+MAX_STYLED_ROWS = 1000
+
+# Parsed uploads and their column lists are cached for the whole server, so
+# shared by every session: keep only a few, and drop them once left unused
+DATA_CACHE_ENTRIES = 4
+DATA_CACHE_TTL = "1h"
+
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES, ttl=DATA_CACHE_TTL)
+def load_csv(file_hash, _file_bytes):
+    # _file_bytes is not hashed by Streamlit, file_hash identifies it instead
+    return pd.read_csv(io.BytesIO(_file_bytes))
+
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES, ttl=DATA_CACHE_TTL)
+def column_items(file_hash, main_column, target_column, _df):
+    # _df is not hashed by Streamlit, file_hash identifies it instead
+    main_items = _df[main_column].dropna().astype(str).tolist()
+    target_items = _df[target_column].dropna().astype(str).unique().tolist()
+    return main_items, target_items
+
+
+def run_match(main_items, target_items, match_method, score_cutoff):
+    """Best target and its score for each main item, with a progress bar."""
+    # Scores only depend on the strings, so match each distinct main item once
+    unique_main, inverse = np.unique(np.asarray(main_items, dtype=object), return_inverse=True)
+    unique_main = unique_main.tolist()
+    
+    main_pre = preprocess(unique_main, match_method)
+    target_pre = preprocess(target_items, match_method)
+    clear_preprocess_cache()
+    target_arr = np.asarray(target_items, dtype=object)
+    
+    best_idx = np.full(len(unique_main), -1, dtype=np.int64)
+    best_score = np.zeros(len(unique_main), dtype=np.uint8)
+    
+    if len(target_items) > 0:
+        if HAS_RAPIDFUZZ and match_method in MATRIX_METHODS:
+            # Score matrix built a block of rows at a time, keeping only each row's best
+            blocks = iter_matrix_best_matches(main_pre, target_pre, match_method, score_cutoff)
+        else:
+            # One extractOne per row, spread over worker processes
+            blocks = iter_best_matches(main_pre, target_pre, match_method, score_cutoff)
+        
+        # Progress bar
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        done = 0
+        
+        # Widget updates are slow, so redraw at most ~100 times
+        step = max(1, len(unique_main) // 100)
+        next_update = step
+        
+        for start, block_idx, block_score in blocks:
+            end = start + len(block_idx)
+            best_idx[start:end] = block_idx
+            best_score[start:end] = block_score
+            
+            # Update progress
+            done += end - start
+            if done >= next_update or done == len(unique_main):
+                next_update = done + step
+                progress = done / len(unique_main)
+                progress_bar.progress(progress)
+                status_text.text(f"Processing: {done}/{len(unique_main)} items ({progress*100:.1f}%)")
+        
+        progress_bar.empty()
+        status_text.empty()
+    
+    # Map the per-unique results back onto every main item
+    best_idx = best_idx[inverse]
+    best_score = best_score[inverse]
+    best_match = np.full(len(main_items), "No match found", dtype=object)
+    found = best_score > 0
+    best_match[found] = target_arr[best_idx[found]]
+    return best_match, best_score
+
+
 st.set_page_config(page_title="Fuzzy Matcher", page_icon="🔍", layout="wide")
 
 st.title("🔍 Fuzzy String Matcher")
 st.markdown("Upload a CSV file to match items from a main column against a target column.")
 
+if not HAS_RAPIDFUZZ:
+    st.warning("rapidfuzz is not installed, falling back to much slower pure Python matching. Run `pip install rapidfuzz` to speed it up.")
+
 # File uploader
 uploaded_file = st.file_uploader("Choose a CSV file", type=['csv'])
 
 if uploaded_file is not None:
-    # Read the CSV
-    df = pd.read_csv(uploaded_file)
+    # Read the CSV (parsed once per file, not on every rerun)
+    file_bytes = uploaded_file.getvalue()
+    file_hash = hashlib.md5(file_bytes).hexdigest()
+    df = load_csv(file_hash, file_bytes)
     
     st.subheader("Preview of uploaded data")
     st.dataframe(df.head(), use_container_width=True)
@@ -54,60 +155,47 @@ if uploaded_file is not None:
         help="Scores above this threshold will be marked as a match"
     )
     
+    skip_unreachable = st.checkbox(
+        "Skip candidates that cannot reach the threshold",
+        help="Faster, especially at high thresholds. Items scoring below the threshold show 'No match found' and a confidence of 0 instead of their closest candidate, which also lowers the Avg Confidence."
+    )
+    
     if st.button("Run Fuzzy Match", type="primary"):
-        # Get unique non-null values from both columns
-        main_items = df[main_column].dropna().astype(str).tolist()
-        target_items = df[target_column].dropna().astype(str).unique().tolist()
-        
-        st.info(f"Matching {len(main_items)} items from main column against {len(target_items)} unique items in target column...")
+        # Get non-null values from both columns (unique ones for the target)
+        main_items, target_items = column_items(file_hash, main_column, target_column, df)
         
-        # Perform fuzzy matching for each main item
-        results = []
+        # Scores are reported rounded, so anything that rounds up to the threshold counts
+        score_cutoff = max(threshold - 0.5, 0) if skip_unreachable else 0
         
-        # Progress bar (outside spinner so it updates properly)
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+        # Reuse the raw matches of an identical earlier run, only the
+        # threshold based status below needs recomputing
+        if 'match_cache' not in st.session_state:
+            st.session_state.match_cache = {}
+        match_cache = st.session_state.match_cache
+        cache_key = (file_hash, main_column, target_column, match_method, score_cutoff)
         
-        for idx, main_item in enumerate(main_items):
-            best_match = None
-            best_score = 0
-            
-            # Compare against all target items
-            for target_item in target_items:
-                # Calculate similarity score based on selected method
-                if match_method == "Ratio":
-                    score = fuzz.ratio(main_item, target_item)
-                elif match_method == "Partial Ratio":
-                    score = fuzz.partial_ratio(main_item, target_item)
-                elif match_method == "Token Sort Ratio":
-                    score = fuzz.token_sort_ratio(main_item, target_item)
-                else:  # Token Set Ratio
-                    score = fuzz.token_set_ratio(main_item, target_item)
-                
-                # Keep track of best match
-                if score > best_score:
-                    best_score = score
-                    best_match = target_item
-            
-            # Determine if it's a match based on threshold
-            is_match = best_score >= threshold
-            
-            results.append({
-                'Main Item': main_item,
-                'Best Match': best_match if best_match else "No match found",
-                'Confidence (%)': best_score,
-                'Match Status': 'Match' if is_match else 'No Match'
-            })
+        if cache_key in match_cache:
+            match_cache[cache_key] = match_cache.pop(cache_key)
+        else:
+            st.info(f"Matching {len(main_items)} items from main column against {len(target_items)} unique items in target column...")
+            match_cache[cache_key] = run_match(main_items, target_items, match_method, score_cutoff)
             
-            # Update progress
-            progress = (idx + 1) / len(main_items)
-            progress_bar.progress(progress)
-            status_text.text(f"Processing: {idx + 1}/{len(main_items)} items ({progress*100:.1f}%)")
+            # Only keep the most recent runs
+            while len(match_cache) > MATCH_CACHE_SIZE:
+                del match_cache[next(iter(match_cache))]
         
-        progress_bar.empty()
-        status_text.empty()
+        best_match, best_score = match_cache[cache_key]
         
-        result_df = pd.DataFrame(results)
+        result_df = pd.DataFrame({
+            'Main Item': main_items,
+            'Best Match': best_match,
+            'Confidence (%)': best_score,
+            # Categorical, so status filters compare int8 codes instead of strings
+            'Match Status': pd.Categorical.from_codes(
+                (best_score < threshold).astype(np.int8),
+                categories=['Match', 'No Match']
+            )
+        })
         
         # Store results in session state
         st.session_state.result_df = result_df
@@ -125,13 +213,14 @@ if uploaded_file is not None:
         with col1:
             st.metric("Total Items", len(result_df))
         with col2:
-            matches = len(result_df[result_df['Match Status'] == 'Match'])
+            matches = int((result_df['Match Status'] == 'Match').sum())
             st.metric("Matches Found", matches)
         with col3:
-            no_matches = len(result_df[result_df['Match Status'] == 'No Match'])
+            no_matches = int((result_df['Match Status'] == 'No Match').sum())
             st.metric("No Matches", no_matches)
         with col4:
-            avg_confidence = result_df['Confidence (%)'].mean()
+            # Scores are kept as uint8; widen only for the average
+            avg_confidence = result_df['Confidence (%)'].astype(np.float32).mean()
             st.metric("Avg Confidence", f"{avg_confidence:.1f}%")
         
         # Filter options
@@ -150,24 +239,39 @@ if uploaded_file is not None:
         else:
             display_df = result_df
         
-        # Display full results with color coding
+        # Display results with color coding
         if len(display_df) > 0:
-            # Apply styling with error handling
-            try:
-                styled_df = display_df.style.apply(
-                    lambda x: ['background-color: #90EE90' if v == 'Match' else 'background-color: #FFB6C6' if v == 'No Match' else '' for v in x],
-                    subset=['Match Status']
-                ).background_gradient(subset=['Confidence (%)'], cmap='RdYlGn', vmin=0, vmax=100)
-                st.dataframe(styled_df, use_container_width=True, height=400)
-            except Exception:
-                # Fallback to simple dataframe if styling fails
+            # Styler renders every cell, so only color the first rows of large results
+            show_all = False
+            if len(display_df) > MAX_STYLED_ROWS:
+                show_all = st.checkbox(
+                    f"Show all {len(display_df)} rows (without colors)",
+                    key="show_all_rows"
+                )
+            
+            if show_all:
                 st.dataframe(display_df, use_container_width=True, height=400)
+            else:
+                shown_df = display_df.head(MAX_STYLED_ROWS)
+                # Apply styling with error handling
+                try:
+                    styled_df = shown_df.style.apply(
+                        lambda x: ['background-color: #90EE90' if v == 'Match' else 'background-color: #FFB6C6' if v == 'No Match' else '' for v in x],
+                        subset=['Match Status']
+                    ).background_gradient(subset=['Confidence (%)'], cmap='RdYlGn', vmin=0, vmax=100)
+                    st.dataframe(styled_df, use_container_width=True, height=400)
+                except Exception:
+                    # Fallback to simple dataframe if styling fails
+                    st.dataframe(shown_df, use_container_width=True, height=400)
+                
+                if len(display_df) > MAX_STYLED_ROWS:
+                    st.caption(f"Showing first {MAX_STYLED_ROWS} of {len(display_df)} rows. The CSV download below has all of them.")
         else:
             st.warning("No results match the selected filter.")
         
-        # Download results
-        csv_buffer = io.StringIO()
-        result_df.to_csv(csv_buffer, index=False)
+        # Download results (serialized by Arrow's C++ CSV writer)
+        csv_buffer = io.BytesIO()
+        pa_csv.write_csv(pa.Table.from_pandas(result_df, preserve_index=False), csv_buffer)
         csv_data = csv_buffer.getvalue()
         
         st.download_button(
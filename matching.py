@@ -0,0 +1,270 @@
+"""Fuzzy matching helpers.
+
+Kept outside the Streamlit script so that worker processes can import them.
+"""
+import bisect
+import functools
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+try:
+    from rapidfuzz import fuzz, process
+    from rapidfuzz.utils import default_process
+    HAS_RAPIDFUZZ = True
+except ImportError:
+    # Last resort, the app still works but is far slower
+    import fallback
+    from fallback import default_process
+    HAS_RAPIDFUZZ = False
+
+_TOKEN_RE = re.compile(r"\S+")
+
+# Canonical forms cached while a run preprocesses its columns, so values
+# shared by both columns skip the tokenizing. The caches are module wide, and
+# so shared by every session: keep them small and clear them after each run.
+PREPROCESS_CACHE_SIZE = 1 << 16
+
+
+@functools.lru_cache(maxsize=PREPROCESS_CACHE_SIZE)
+def sort_tokens(s):
+    """Normalized tokens of ``s`` in sorted order, joined by spaces."""
+    return " ".join(sorted(_TOKEN_RE.findall(default_process(s))))
+
+
+@functools.lru_cache(maxsize=PREPROCESS_CACHE_SIZE)
+def set_tokens(s):
+    """Distinct normalized tokens of ``s`` in sorted order, joined by spaces."""
+    return " ".join(sorted(set(_TOKEN_RE.findall(default_process(s)))))
+
+
+# Matching method -> (scorer, preprocessor). Strings are preprocessed once up
+# front, so scorers never redo the tokenizing per pair. Token Sort Ratio is
+# plain ratio on the sorted forms; token_set_ratio only depends on the token
+# sets, so it gives the same scores on the deduplicated forms.
+#
+# fuzz.ratio already is 100 * Indel.normalized_similarity, computed with the
+# bit-parallel (and blocked, past 64 characters) Myers/Hyyro kernel. Pass the
+# rapidfuzz scorers to process.* unwrapped: any Python wrapper would force
+# rapidfuzz to call back into Python for every pair.
+if HAS_RAPIDFUZZ:
+    SCORERS = {
+        "Ratio": (fuzz.ratio, None),
+        "Partial Ratio": (fuzz.partial_ratio, None),
+        "Token Sort Ratio": (fuzz.ratio, sort_tokens),
+        "Token Set Ratio": (fuzz.token_set_ratio, set_tokens),
+    }
+    extract_one = process.extractOne
+else:
+    SCORERS = {
+        "Ratio": (fallback.ratio, None),
+        "Partial Ratio": (fallback.partial_ratio, None),
+        "Token Sort Ratio": (fallback.ratio, sort_tokens),
+        "Token Set Ratio": (fallback.token_set_ratio, set_tokens),
+    }
+    extract_one = fallback.extract_one
+
+# Methods scored with plain ratio, which can never exceed
+# 200 * min(len(a), len(b)) / (len(a) + len(b)) whatever the characters are
+LENGTH_BOUNDED = {"Ratio", "Token Sort Ratio"}
+
+# Methods scored through the cdist score matrix when rapidfuzz is installed.
+# cdist runs ratio several times faster than one extractOne per row, but
+# partial_ratio and token_set_ratio skip most of their work per pair once
+# extractOne's running cutoff is high, which a full matrix can never do.
+MATRIX_METHODS = LENGTH_BOUNDED
+
+# Main items scored per cdist call, which also sets the progress granularity
+MATRIX_CHUNK_ROWS = 512
+
+# Largest block of the score matrix (one byte per cell) held in memory at once
+MAX_MATRIX_CELLS = 50_000_000
+
+# Main items handed to a worker process per task
+CHUNK_SIZE = 64
+
+# Per worker state, set once by _init_worker
+_targets = None
+_target_order = None
+_target_lens = None
+_length_bounded = False
+_scorer = None
+_score_cutoff = 0
+
+
+def preprocess(items, match_method):
+    """Return ``items`` in the form the scorer for ``match_method`` expects."""
+    _, preprocessor = SCORERS[match_method]
+    if preprocessor is None:
+        return items
+    return [preprocessor(item) for item in items]
+
+
+def clear_preprocess_cache():
+    """Drop the canonical forms cached by ``preprocess``."""
+    sort_tokens.cache_clear()
+    set_tokens.cache_clear()
+
+
+def score_matrix(main_items, target_items, match_method, score_cutoff=0):
+    """Scores of every main item against every target item, as a uint8 matrix.
+
+    Both lists must already be preprocessed for ``match_method``. Needs
+    rapidfuzz.
+    """
+    scorer, _ = SCORERS[match_method]
+    return process.cdist(
+        main_items,
+        target_items,
+        scorer=scorer,
+        workers=-1,
+        dtype=np.uint8,
+        score_cutoff=score_cutoff
+    )
+
+
+def iter_matrix_best_matches(main_items, target_items, match_method, score_cutoff=0):
+    """Find the best target for each main item with rapidfuzz's cdist.
+
+    The score matrix is computed a block of rows at a time, so memory stays
+    bounded by ``MAX_MATRIX_CELLS`` whatever the input size. Both lists must
+    already be preprocessed for ``match_method`` and ``target_items`` must not
+    be empty. Yields ``(start, target_indices, scores)`` for consecutive
+    blocks of ``main_items``. cdist only prunes on the fixed ``score_cutoff``,
+    never on a running best score.
+    """
+    rows = max(1, min(MATRIX_CHUNK_ROWS, MAX_MATRIX_CELLS // len(target_items)))
+    for start in range(0, len(main_items), rows):
+        scores = score_matrix(main_items[start:start + rows], target_items, match_method, score_cutoff)
+        best_idx = scores.argmax(axis=1)
+        yield start, best_idx, scores[np.arange(len(best_idx)), best_idx]
+
+
+def _init_worker(target_items, match_method, score_cutoff):
+    global _targets, _target_order, _target_lens, _length_bounded, _scorer, _score_cutoff
+    # Resolve the scorer once per worker rather than once per chunk
+    _scorer, _ = SCORERS[match_method]
+    _score_cutoff = score_cutoff
+    _targets = target_items
+    # rapidfuzz's ratio already rejects lengths that cannot reach the cutoff
+    # before doing any work, so only the fallback needs the length window
+    _length_bounded = not HAS_RAPIDFUZZ and _score_cutoff > 0 and match_method in LENGTH_BOUNDED
+    if not HAS_RAPIDFUZZ:
+        # Sort targets by length, once per worker, so each main item can slice
+        # out the lengths able to reach the cutoff and the targets closest in
+        # length are scored first
+        lens = np.fromiter(map(len, target_items), dtype=np.int64, count=len(target_items))
+        order = np.argsort(lens, kind="stable")
+        # Plain lists, which bisect and index much faster than arrays one
+        # element at a time
+        _target_order = order.tolist()
+        _target_lens = lens[order].tolist()
+    else:
+        _target_order = None
+        _target_lens = None
+
+
+def _length_window(la):
+    """Slice of the length sorted targets that can score ``_score_cutoff`` against length ``la``."""
+    # 200 * min(la, lb) >= cutoff * (la + lb), solved for lb on either side of la
+    lo = la * _score_cutoff / (200 - _score_cutoff)
+    hi = la * (200 - _score_cutoff) / _score_cutoff
+    start = bisect.bisect_left(_target_lens, lo - 1e-9)
+    end = bisect.bisect_right(_target_lens, hi + 1e-9)
+    return start, end
+
+
+def _nearest_first(la, start, end):
+    """Indices of the length sorted targets in ``[start, end)``, closest in length to ``la`` first."""
+    hi = bisect.bisect_left(_target_lens, la, start, end)
+    lo = hi - 1
+    # Walk outward from la, taking whichever side is closer
+    while lo >= start and hi < end:
+        if la - _target_lens[lo] <= _target_lens[hi] - la:
+            yield _target_order[lo]
+            lo -= 1
+        else:
+            yield _target_order[hi]
+            hi += 1
+    yield from _target_order[hi:end]
+    yield from reversed(_target_order[start:lo + 1])
+
+
+def _extract_lowest(main_item):
+    """extractOne over the targets, with ties on the rounded score going to the lowest index.
+
+    extractOne keeps the first target with the highest float score, but the
+    scores are reported rounded, and cdist's argmax picks the first target
+    with the highest rounded score. Earlier targets than the one found all
+    score lower, so keep looking before it for one that still rounds the same.
+    """
+    match = extract_one(main_item, _targets, scorer=_scorer, score_cutoff=_score_cutoff)
+    if match is None:
+        return None
+    _, score, index = match
+    cutoff = max(_score_cutoff, int(score + 0.5) - 0.5)
+    while index > 0:
+        earlier = extract_one(main_item, _targets[:index], scorer=_scorer, score_cutoff=cutoff)
+        if earlier is None:
+            break
+        _, score, index = earlier
+    return _targets[index], score, index
+
+
+def _match_chunk(args):
+    start, main_chunk = args
+    indices = np.full(len(main_chunk), -1, dtype=np.int64)
+    scores = np.zeros(len(main_chunk), dtype=np.uint8)
+    for row, main_item in enumerate(main_chunk):
+        if HAS_RAPIDFUZZ:
+            match = _extract_lowest(main_item)
+        else:
+            if _length_bounded:
+                offset, end = _length_window(len(main_item))
+            else:
+                offset, end = 0, len(_targets)
+            match = extract_one(
+                main_item,
+                _targets,
+                scorer=_scorer,
+                score_cutoff=_score_cutoff,
+                order=_nearest_first(len(main_item), offset, end)
+            )
+        if match is not None:
+            _, score, index = match
+            indices[row] = index
+            # Round half up, like cdist does for integer dtypes
+            scores[row] = int(score + 0.5)
+    return start, indices, scores
+
+
+def iter_best_matches(main_items, target_items, match_method, score_cutoff=0, chunk_size=CHUNK_SIZE):
+    """Find the best target for each main item using a pool of processes.
+
+    Each row goes through extract_one, which raises its cutoff to the best
+    score found so far, so later targets can be cut short by the scorer.
+    Both lists must already be preprocessed for ``match_method``. Yields
+    ``(start, target_indices, scores)`` as chunks finish, in no particular
+    order, covering ``main_items[start:start + len(scores)]``; an index is -1
+    when no target scores at least ``score_cutoff``.
+    """
+    chunks = [
+        (start, main_items[start:start + chunk_size])
+        for start in range(0, len(main_items), chunk_size)
+    ]
+    # Spawn rather than fork: the Streamlit server is multithreaded
+    executor = ProcessPoolExecutor(
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(target_items, match_method, score_cutoff)
+    )
+    try:
+        futures = [executor.submit(_match_chunk, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Streamlit stops a run by raising inside the consumer, which closes
+        # this generator; drop the queued chunks instead of waiting for them
+        executor.shutdown(wait=False, cancel_futures=True)